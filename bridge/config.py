@@ -0,0 +1,64 @@
+import json
+import os
+from dataclasses import dataclass
+
+
+@dataclass(slots=True)
+class ServerConfig:
+    """Discord or Spacebar server connection settings"""
+    host: str
+    cdn_host: str
+    token: str
+
+
+@dataclass(slots=True)
+class DatabaseConfig:
+    """SQLite or PostgreSQL database settings"""
+    dir_path: str
+    postgresql_host: str | None
+    postgresql_user: str
+    postgresql_password: str
+    cleanup_days: int
+    pair_lifetime_days: int
+
+
+@dataclass(slots=True)
+class FormatConfig:
+    """Bridged message formatting settings"""
+    format_interaction: str
+    format_one_reaction: str
+    reactions_separator: str
+
+
+@dataclass(slots=True)
+class BridgePair:
+    """Pair of bridged Discord and Spacebar channels"""
+    discord_channel_id: str
+    spacebar_channel_id: str
+
+
+@dataclass(slots=True)
+class Config:
+    """Bridge config"""
+    discord: ServerConfig
+    spacebar: ServerConfig
+    database: DatabaseConfig
+    custom_status: str | None
+    custom_status_emoji: dict | None
+    format: FormatConfig
+    discord_guild_id: str
+    spacebar_guild_id: str
+    bridges: list[BridgePair]
+
+
+def load_config(path="config.json"):
+    """Load config from json file, unknown or missing keys raise TypeError"""
+    with open(path, "r") as f:
+        config = json.load(f)
+    config["discord"] = ServerConfig(**config["discord"])
+    config["spacebar"] = ServerConfig(**config["spacebar"])
+    config["database"] = DatabaseConfig(**config["database"])
+    config["database"].dir_path = os.path.expanduser(config["database"].dir_path)
+    config["format"] = FormatConfig(**config["format"])
+    config["bridges"] = [BridgePair(**bridge) for bridge in config["bridges"]]
+    return Config(**config)
@@ -6,6 +6,13 @@ import apsw
 
 logger = logging.getLogger(__name__)
 DISCORD_EPOCH = 1420070400000
+CONNECTION_PRAGMAS = (
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",   # 256MB
+    "PRAGMA cache_size=-65536",   # 64MB
+)
+BUSY_TIMEOUT = 5000   # ms
 
 
 def snowflake_to_timestamp(snowflake):
@@ -24,6 +31,7 @@ class PairStore:
 
         self.conn = apsw.Connection(self.db_path)
         self.cleanup_conn = apsw.Connection(self.db_path)
+        self.lock = threading.Lock()   # conn is shared by channel worker threads, apsw allows one at a time
         self.init_db()
 
         self.run  = True
@@ -34,9 +42,15 @@ class PairStore:
 
     def init_db(self):
         """Initialize database"""
+        # main and cleanup connections can write at the same time, so wait for lock instead of raising BusyError
+        for conn in (self.conn, self.cleanup_conn):
+            conn.setbusytimeout(BUSY_TIMEOUT)
         cur = self.conn.cursor()
-        cur.execute("PRAGMA journal_mode=WAL")
-        cur.execute("PRAGMA synchronous=NORMAL")
+        cur.execute("PRAGMA journal_mode=WAL").fetchall()   # persistent, set once for database file
+        # these are per connection
+        for conn in (self.conn, self.cleanup_conn):
+            for pragma in CONNECTION_PRAGMAS:
+                conn.execute(pragma).fetchall()
         # table to track which channel tables exist
         cur.execute("""
             CREATE TABLE IF NOT EXISTS channels (
@@ -48,7 +62,7 @@ class PairStore:
 
     def create_table(self, channel_pair):
         """Create table for channel if it doesnt exist"""
-        with self.conn:
+        with self.lock, self.conn:
             self.conn.execute(f"""
                 CREATE TABLE IF NOT EXISTS {channel_pair} (
                     source TEXT PRIMARY KEY,
@@ -61,21 +75,30 @@ class PairStore:
 
     def add_pair(self, channel_pair, source, target):
         """Add a pair of source and target message snowflakes"""
-        with self.conn:
+        with self.lock, self.conn:
             self.conn.execute(f"INSERT OR REPLACE INTO {channel_pair} (source, target) VALUES (?, ?)", (source, target))
 
 
     def get_target(self, channel_pair, source):
         """Get target id from source in a pair, if not found return none"""
-        row = self.conn.execute(f"SELECT target FROM {channel_pair} WHERE source = ? LIMIT 1", (source,)).fetchone()
+        with self.lock:
+            row = self.conn.execute(f"SELECT target FROM {channel_pair} WHERE source = ? LIMIT 1", (source,)).fetchone()
         if row:
             return row[0]
         return None
 
 
+    def get_targets(self, channel_pair, sources):
+        """Get target ids for multiple sources in one query, return dict of source: target for found pairs"""
+        placeholders = ", ".join("?" * len(sources))
+        with self.lock:
+            return dict(self.conn.execute(f"SELECT source, target FROM {channel_pair} WHERE source IN ({placeholders})", sources).fetchall())
+
+
     def get_source(self, channel_pair, target):
         """Get source id from target in a pair, if not found return none"""
-        row = self.conn.execute(f"SELECT source FROM {channel_pair} WHERE target = ? LIMIT 1", (target,)).fetchone()
+        with self.lock:
+            row = self.conn.execute(f"SELECT source FROM {channel_pair} WHERE target = ? LIMIT 1", (target,)).fetchone()
         if row:
             return row[0]
         return None
@@ -83,7 +106,7 @@ class PairStore:
 
     def delete_pair(self, channel_pair, source):
         """Delete a pair by source"""
-        with self.conn:
+        with self.lock, self.conn:
             self.conn.execute(f"DELETE FROM {channel_pair} WHERE source = ?", (source,))
 
 
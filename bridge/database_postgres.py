@@ -32,6 +32,7 @@ class PairStore:
         # connect to database
         self.conn = psycopg.connect(host=host, user=user, password=password, dbname=dbname, autocommit=True)
         self.cleanup_conn = psycopg.connect(host=host, user=user, password=password, dbname=dbname, autocommit=True)
+        self.lock = threading.Lock()   # conn is shared by channel worker threads
         self.init_db()
 
         self.run  = True
@@ -53,7 +54,7 @@ class PairStore:
 
     def create_table(self, channel_pair):
         """Create table for channel if it doesnt exist"""
-        with self.conn.cursor() as cur:
+        with self.lock, self.conn.cursor() as cur:
             cur.execute(f"""
                 CREATE TABLE IF NOT EXISTS {channel_pair} (
                     source TEXT PRIMARY KEY,
@@ -66,7 +67,7 @@ class PairStore:
 
     def add_pair(self, channel_pair, source, target):
         """Add a pair of source and target message snowflakes"""
-        with self.conn.cursor() as cur:
+        with self.lock, self.conn.cursor() as cur:
             cur.execute(f"""
                 INSERT INTO {channel_pair} (source, target)
                 VALUES (%s, %s)
@@ -76,16 +77,23 @@ class PairStore:
 
     def get_target(self, channel_pair, source):
         """Get target id from source in a pair, if not found return none"""
-        with self.conn.cursor() as cur:
+        with self.lock, self.conn.cursor() as cur:
             row = cur.execute(f"SELECT target FROM {channel_pair} WHERE source = %s LIMIT 1", (source,)).fetchone()
         if row:
             return row[0]
         return None
 
 
+    def get_targets(self, channel_pair, sources):
+        """Get target ids for multiple sources in one query, return dict of source: target for found pairs"""
+        with self.lock, self.conn.cursor() as cur:
+            rows = cur.execute(f"SELECT source, target FROM {channel_pair} WHERE source = ANY(%s)", (list(sources),)).fetchall()
+        return dict(rows)
+
+
     def get_source(self, channel_pair, target):
         """Get source id from target in a pair, if not found return none"""
-        with self.conn.cursor() as cur:
+        with self.lock, self.conn.cursor() as cur:
             row = cur.execute(f"SELECT source FROM {channel_pair} WHERE target = %s LIMIT 1", (target,)).fetchone()
         if row:
             return row[0]
@@ -94,7 +102,7 @@ class PairStore:
 
     def delete_pair(self, channel_pair, source):
         """Delete a pair by source"""
-        with self.conn.cursor() as cur:
+        with self.lock, self.conn.cursor() as cur:
             cur.execute(f"DELETE FROM {channel_pair} WHERE source = %s", (source,))
 
 
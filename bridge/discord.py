@@ -1,18 +1,43 @@
+import functools
 import http.client
-import json
 import logging
 import socket
+import threading
 import time
-import urllib
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+import orjson
 
 from bridge.message import prepare_messages
 
 logger = logging.getLogger(__name__)
+DISCORD_EPOCH = 1420070400000
+MESSAGES_PAGE_SIZE = 50
+REACTION_ADD_QUERY = "/%40me?location=Message%20Reaction%20Picker&type=0"
+REACTION_REMOVE_QUERY = "/0/%40me?location=Message%20Inline%20Button&burst=false"
+RATE_LIMIT_RETRIES = 3
+BODY_METHODS = ("PATCH", "POST", "PUT")
+
+
+@functools.lru_cache(maxsize=1024)
+def messages_path(channel_id):
+    """Get api path to messages in the channel"""
+    return f"/api/v9/channels/{channel_id}/messages"
+
+
+def get_route(method, url):
+    """Get rate limit route from method and url, all messages in one channel share the route"""
+    path = url.split("?", 1)[0]
+    route = "/".join(path.split("/", 6)[:6])
+    if "/reactions/" in path:
+        route += "/reactions"
+    return f"{method} {route}"
 
 
 def generate_nonce():
     """Generate nonce string - current UTC time as discord snowflake"""
-    return str((int(time.time() * 1000) - 1420070400 * 1000) << 22)
+    return str((time.time_ns() // 1000000 - DISCORD_EPOCH) << 22)
 
 
 class Discord():
@@ -31,40 +56,193 @@ class Discord():
             "Authorization": f"Bot {self.token}",
             "Content-Type": "application/json",
         }
+        self.header_items = tuple(self.header.items())
+        # each thread gets its own persistent connection so requests can run in parallel
+        self.local = threading.local()
+        self.connections = set()
+        self.rate_limits = {}   # route: (remaining, reset_time)
+        self.channel_workers = {}
+        self.channel_workers_lock = threading.Lock()
+        self.closed = False
+
+
+    def submit(self, channel_id, function, *args, **kwargs):
+        """
+        Run function in worker thread of the channel and return its future.
+        Calls for same channel run in order, back-to-back on worker's persistent connection,
+        calls for different channels run in parallel.
+        Return None if client is closed.
+        """
+        with self.channel_workers_lock:
+            if self.closed:
+                return None
+            worker = self.channel_workers.get(channel_id)
+            if not worker:
+                worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"{self.name}-{channel_id}")
+                self.channel_workers[channel_id] = worker
+            return worker.submit(function, *args, **kwargs)
+
+
+    def get_connection(self):
+        """Get persistent connection object for current thread, create new one if there is none"""
+        connection = getattr(self.local, "connection", None)
+        if not connection:
+            connection = http.client.HTTPSConnection(self.host, 443, timeout=5)
+            self.local.connection = connection
+            self.connections.add(connection)
+        return connection
+
+
+    def close_connection(self):
+        """Close persistent connection of current thread, next request will open new one"""
+        connection = getattr(self.local, "connection", None)
+        if connection:
+            connection.close()
+            self.connections.discard(connection)
+            self.local.connection = None
+
+
+    def close(self):
+        """Stop channel workers after their queued calls are done and close all persistent connections"""
+        with self.channel_workers_lock:
+            self.closed = True
+            workers = list(self.channel_workers.values())
+            self.channel_workers.clear()
+        for worker in workers:
+            worker.shutdown(wait=True)
+        for connection in list(self.connections):
+            connection.close()
+        self.connections.clear()
+
+
+    def wait_rate_limit(self, route):
+        """Sleep until rate limit for this route is reset, if there are no remaining requests"""
+        rate_limit = self.rate_limits.get(route)
+        if rate_limit and rate_limit[0] <= 0:
+            delay = rate_limit[1] - time.monotonic()
+            if delay > 0:
+                logger.debug(f"({self.name}) Waiting {delay:.2f}s for rate limit on {route}")
+                time.sleep(delay)
+
+
+    def update_rate_limit(self, route, response):
+        """Store rate limit state for this route from response headers"""
+        remaining = response.getheader("X-RateLimit-Remaining")
+        reset_after = response.getheader("X-RateLimit-Reset-After")
+        if remaining is not None and reset_after is not None:
+            self.rate_limits[route] = (int(remaining), time.monotonic() + float(reset_after))
+
+
+    def request(self, method, url, body=None):
+        """
+        Send request respecting rate limits, if rate limited, wait and retry with exponential backoff.
+        Return response status and data, or None and None if there is no connection.
+        """
+        route = get_route(method, url)
+        for attempt in range(RATE_LIMIT_RETRIES + 1):
+            self.wait_rate_limit(route)
+            status, data = self.send_request(method, url, body, route)
+            if status != 429 or attempt == RATE_LIMIT_RETRIES:
+                return status, data
+            try:
+                retry_after = float(orjson.loads(data)["retry_after"])
+            except (ValueError, KeyError, TypeError):
+                retry_after = 0
+            retry_after = max(retry_after, 2 ** attempt / 2)
+            logger.warning(f"({self.name}) Rate limited on {route}, retrying in {retry_after:.2f}s")
+            time.sleep(retry_after)
+
+
+    def send_request(self, method, url, body, route):
+        """
+        Send request over persistent connection of current thread and read whole response so connection can be reused.
+        If connection was dropped by the server, reconnect once and retry.
+        Return response status and data, or None and None if there is no connection.
+        """
+        # body is already bytes so http.client doesnt have to encode it and compute its length
+        if body is not None:
+            content_length = str(len(body))
+        elif method in BODY_METHODS:
+            content_length = "0"
+        else:
+            content_length = None
+        for retry in (True, False):
+            connection = self.get_connection()
+            try:
+                connection.putrequest(method, url)
+                for header, value in self.header_items:
+                    connection.putheader(header, value)
+                if content_length:
+                    connection.putheader("Content-Length", content_length)
+                connection.endheaders(body)
+                response = connection.getresponse()
+                data = response.read()
+                self.update_rate_limit(route, response)
+                return response.status, data
+            except (http.client.BadStatusLine, ConnectionError):
+                self.close_connection()
+                if not retry:
+                    return None, None
+            except (socket.gaierror, TimeoutError):
+                self.close_connection()
+                return None, None
 
 
-    def get_connection(self, host, port):
-        """Get connection object"""
-        return http.client.HTTPSConnection(host, port, timeout=5)
+    def do_request(self, method, url, body=None, expected=200, action="send request"):
+        """
+        Send request and return response data if response status is as expected.
+        Otherwise log error with action description and return None.
+        """
+        status, data = self.request(method, url, body)
+        if status == expected:
+            return data
+        if status is not None:
+            logger.error(f"({self.name}) Failed to {action}. Response code: {status}")
+        return None
 
 
     def get_messages(self, channel_id, num=50, before=None, after=None, around=None):
         """Get specified number of messages, optionally number before and after message ID"""
-        message_data = None
-        url = f"/api/v9/channels/{channel_id}/messages?limit={num}"
+        params = {"limit": num}
         if before:
-            url += f"&before={before}"
+            params["before"] = before
         if after:
-            url += f"&after={after}"
+            params["after"] = after
         if around:
-            url += f"&around={around}"
-        try:
-            connection = self.get_connection(self.host, 443)
-            connection.request("GET", url, message_data, self.header)
-            response = connection.getresponse()
-        except (socket.gaierror, TimeoutError):
-            connection.close()
+            params["around"] = around
+        url = f"{messages_path(channel_id)}?{urllib.parse.urlencode(params)}"
+        data = self.do_request("GET", url, action="fetch messages")
+        if data is None:
             return None
-        if response.status == 200:
-            data = json.loads(response.read())
-            connection.close()
-            # debug_chat
-            # with open("messages.json", "w") as f:
-            #     json.dump(data, f, indent=2)
-            return prepare_messages(data)
-        logger.error(f"({self.name}) Failed to fetch messages. Response code: {response.status}")
-        connection.close()
-        return None
+        data = orjson.loads(data)
+        # debug_chat
+        # with open("messages.json", "w") as f:
+        #     json.dump(data, f, indent=2)
+        return prepare_messages(data)
+
+
+    def get_messages_stream(self, channel_id, total, before=None):
+        """
+        Get up to total number of messages, newest first, optionally before message ID.
+        First page is fetched in calling thread, next page is prefetched in separate thread while current one is consumed.
+        Prefetch does not use channel workers, so this can be called from inside them.
+        """
+        if total <= 0:
+            return
+        num = min(total, MESSAGES_PAGE_SIZE)
+        messages = self.get_messages(channel_id, num, before)
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"{self.name}-{channel_id}-prefetch") as prefetcher:
+            try:
+                while messages:
+                    total -= len(messages)
+                    future = None
+                    if total > 0 and len(messages) == num:
+                        num = min(total, MESSAGES_PAGE_SIZE)
+                        future = prefetcher.submit(self.get_messages, channel_id, num, messages[-1]["id"])
+                    yield from messages
+                    messages = future.result() if future else None
+            finally:
+                prefetcher.submit(self.close_connection)   # prefetch thread ends here, so its connection wont be reused
 
 
     def send_message(self, channel_id, message_content, reply_id=None, reply_channel_id=None, reply_guild_id=None, reply_ping=True, attachments=None, embeds=None, stickers=None):
@@ -111,22 +289,12 @@ class Discord():
             message_dict["embeds"] = embeds
         if stickers:
             message_dict["sticker_ids"] = stickers
-        message_data = json.dumps(message_dict)
-        url = f"/api/v9/channels/{channel_id}/messages"
-        try:
-            connection = self.get_connection(self.host, 443)
-            connection.request("POST", url, message_data, self.header)
-            response = connection.getresponse()
-        except (socket.gaierror, TimeoutError):
-            connection.close()
+        message_data = orjson.dumps(message_dict)
+        url = messages_path(channel_id)
+        data = self.do_request("POST", url, message_data, action="send message")
+        if data is None:
             return None
-        if response.status == 200:
-            message_id = json.loads(response.read())["id"]
-            connection.close()
-            return message_id
-        logger.error(f"({self.name}) Failed to send message. Response code: {response.status}")
-        connection.close()
-        return None
+        return orjson.loads(data)["id"]
 
 
     def send_update_message(self, channel_id, message_id, message_content, embeds):
@@ -136,77 +304,26 @@ class Discord():
         }
         if embeds:
             message_dict["embeds"] = embeds
-        message_data = json.dumps(message_dict)
-        url = f"/api/v9/channels/{channel_id}/messages/{message_id}"
-        try:
-            connection = self.get_connection(self.host, 443)
-            connection.request("PATCH", url, message_data, self.header)
-            response = connection.getresponse()
-        except (socket.gaierror, TimeoutError):
-            connection.close()
-            return False
-        if response.status == 200:
-            connection.close()
-            return True
-        logger.error(f"({self.name}) Failed to edit the message. Response code: {response.status}")
-        connection.close()
-        return False
+        message_data = orjson.dumps(message_dict)
+        url = f"{messages_path(channel_id)}/{message_id}"
+        return self.do_request("PATCH", url, message_data, action="edit the message") is not None
 
 
     def send_delete_message(self, channel_id, message_id):
         """Delete the message from the channel"""
-        message_data = None
-        url = f"/api/v9/channels/{channel_id}/messages/{message_id}"
-        try:
-            connection = self.get_connection(self.host, 443)
-            connection.request("DELETE", url, message_data, self.header)
-            response = connection.getresponse()
-        except (socket.gaierror, TimeoutError):
-            connection.close()
-            return None
-        if response.status != 204:
-            logger.error(f"({self.name}) Failed to delete the message. Response code: {response.status}")
-            connection.close()
-            return False
-        connection.close()
-        return True
+        url = f"{messages_path(channel_id)}/{message_id}"
+        return self.do_request("DELETE", url, expected=204, action="delete the message") is not None
 
 
     def send_reaction(self, channel_id, message_id, reaction):
         """Send reaction to specified message"""
         encoded_reaction = urllib.parse.quote(reaction)
-        message_data = None
-        url = f"/api/v9/channels/{channel_id}/messages/{message_id}/reactions/{encoded_reaction}/%40me?location=Message%20Reaction%20Picker&type=0"
-        try:
-            connection = self.get_connection(self.host, 443)
-            connection.request("PUT", url, message_data, self.header)
-            response = connection.getresponse()
-        except (socket.gaierror, TimeoutError):
-            connection.close()
-            return None
-        if response.status != 204:
-            logger.error(f"({self.name}) Failed to send reaction: {reaction}. Response code: {response.status}")
-            connection.close()
-            return False
-        connection.close()
-        return True
+        url = f"{messages_path(channel_id)}/{message_id}/reactions/{encoded_reaction}{REACTION_ADD_QUERY}"
+        return self.do_request("PUT", url, expected=204, action=f"send reaction: {reaction}") is not None
 
 
     def remove_reaction(self, channel_id, message_id, reaction):
         """Remove reaction from specified message"""
         encoded_reaction = urllib.parse.quote(reaction)
-        message_data = None
-        url = f"/api/v9/channels/{channel_id}/messages/{message_id}/reactions/{encoded_reaction}/0/%40me?location=Message%20Inline%20Button&burst=false"
-        try:
-            connection = self.get_connection(self.host, 443)
-            connection.request("DELETE", url, message_data, self.header)
-            response = connection.getresponse()
-        except (socket.gaierror, TimeoutError):
-            connection.close()
-            return None
-        if response.status != 204:
-            logger.error(f"({self.name}) Failed to delete reaction: {reaction}. Response code: {response.status}")
-            connection.close()
-            return False
-        connection.close()
-        return True
+        url = f"{messages_path(channel_id)}/{message_id}/reactions/{encoded_reaction}{REACTION_REMOVE_QUERY}"
+        return self.do_request("DELETE", url, expected=204, action=f"delete reaction: {reaction}") is not None
@@ -1,99 +1,52 @@
 import re
 import time
 
-match_d_emoji = re.compile(r"<(.?):(.*?):(\d*?)>")
-match_mention = re.compile(r"<@(\d*?)>")
-match_role = re.compile(r"<@&(\d*?)>")
-match_channel = re.compile(r"<#(\d*?)>")
-match_discord_channel_url = re.compile(r"https:\/\/discord\.com\/channels\/(\d*)\/(\d*)(?:\/(\d*))?")
-
-
-def replace_discord_emoji(text):
-    """
-    Transform emoji strings into nicer looking ones:
-    `some text <:emoji_name:emoji_id> more text` --> `some text :emoji_name: more text`
-    """
-    result = []
-    last_pos = 0
-    for match in re.finditer(match_d_emoji, text):
-        result.append(text[last_pos:match.start()])
-        result.append(f":{match.group(2)}:")
-        last_pos = match.end()
-    result.append(text[last_pos:])
-    return "".join(result)
-
-
-def replace_mentions(text, usernames_ids):
+match_entity = re.compile(
+    r"<.?:(?P<emoji>[^<>]*?):\d*?>"
+    r"|<@(?P<mention>\d*?)>"
+    r"|<@&(?P<role>\d*?)>"
+    r"|<#(?P<channel>\d*?)>"
+    r"|https:\/\/discord\.com\/channels\/\d*\/(?P<url>\d*)(?:\/(?P<url_message>\d*))?",
+)
+sub_entities = match_entity.sub
+STICKER_FORMATS = {
+    1: "[(png sticker)]({})",
+    2: "[(apng sticker)]({})",
+    3: "(lottie sticker: {})",
+}
+STICKER_FORMAT_DEFAULT = "[(gif sticker)]({})"
+POLL_OPTION_FORMAT = ">   {} {} ({} votes, {}%)"
+
+
+def replace_entities(text, usernames, roles, channels):
     """
-    Transforms mention string into nicer looking one:
-    `some text <@user_id> more text` --> `some text @username more text`
+    Transform emojis, mentions, roles, channels and discord channel urls into nicer looking ones, in one pass:
+    `<:emoji_name:emoji_id>` --> `:emoji_name:`
+    `<@user_id>` --> `@username`
+    `<@&role_id>` --> `@role_name`
+    `<#channel_id>` --> `#channel_name`
+    `https://discord.com/channels/guild_id/channel_id/message_id` --> `#channel_name>MSG`
+    usernames is dict: {id: name}, roles and channels are dicts: {id: {"id", "name", ...}}
     """
-    result = []
-    last_pos = 0
-    for match in re.finditer(match_mention, text):
-        result.append(text[last_pos:match.start()])
-        for user in usernames_ids:
-            if match.group(1) == user["id"]:
-                result.append(f"@{user["username"]}")
-                break
-        last_pos = match.end()
-    result.append(text[last_pos:])
-    return "".join(result)
-
-
-def replace_roles(text, roles_ids):
-    """
-    Transforms roles string into nicer looking one:
-    `some text <@role_id> more text` --> `some text @role_name more text`
-    """
-    result = []
-    last_pos = 0
-    for match in re.finditer(match_role, text):
-        result.append(text[last_pos:match.start()])
-        for role in roles_ids:
-            if match.group(1) == role["id"]:
-                result.append(f"@{role["name"]}")
-                break
+    def replace(match):
+        kind = match.lastgroup
+        if kind == "emoji":
+            return f":{match["emoji"]}:"
+        if kind == "mention":
+            user_id = match["mention"]
+            return f"@{usernames[user_id]}" if user_id in usernames else ""
+        if kind == "role":
+            role = roles.get(match["role"])
+            return f"@{role["name"]}" if role else "@unknown_role"
+        channel = channels.get(match["channel"] if kind == "channel" else match["url"])
+        if channel:
+            channel = f"#{channel["name"]}"
         else:
-            result.append("@unknown_role")
-        last_pos = match.end()
-    result.append(text[last_pos:])
-    return "".join(result)
-
-
-def replace_discord_url(text):
-    """Replace discord url for channel and message"""
-    result = []
-    last_pos = 0
-    for match in re.finditer(match_discord_channel_url, text):
-        result.append(text[last_pos:match.start()])
-        if match.group(3):
-            result.append(f"<#{match.group(2)}>>MSG")
-        else:
-            result.append(f"<#{match.group(2)}>")
-        last_pos = match.end()
-    result.append(text[last_pos:])
-    return "".join(result)
-
-
-def replace_channels(text, channels_ids):
-    """
-    Transforms channels string into nicer looking one:
-    `some text <#channel_id> more text` --> `some text #channel_name more text`
-    """
-    result = []
-    last_pos = 0
-    for match in re.finditer(match_channel, text):
-        result.append(text[last_pos:match.start()])
-        for channel in channels_ids:
-            if match.group(1) == channel["id"]:
-                result.append(f"#{channel["name"]}")
-                break
-        else:
-            result.append("@unknown_channel")
-        last_pos = match.end()
-    result.append(text[last_pos:])
-    return "".join(result)
+            channel = "@unknown_channel"
+        if match["url_message"]:
+            return f"{channel}>MSG"
+        return channel
+    return sub_entities(replace, text)
 
 
 def clean_type(embed_type):
@@ -112,70 +65,56 @@ def format_poll(poll):
     else:
         status = "ongoing"
         expires = "Ends"
-    content_list = [
-        f"*Poll ({status}):*",
-        poll["question"],
+    lines = [
+        f"> *Poll ({status}):*",
+        f"> {poll["question"]}",
     ]
-    total_votes = 0
-    for option in poll["options"]:
-        total_votes += int(option["count"])
+    total_votes = sum(option["count"] for option in poll["options"])
     for option in poll["options"]:
         if total_votes:
             answer_votes = option["count"]
-            percent = round((answer_votes / total_votes) * 100)
+            percent = round(answer_votes * 100 / total_votes)
         else:
             answer_votes = 0
             percent = 0
-        content_list.append(f"  {"*" if option["me_voted"] else "-"} {option["answer"]} ({answer_votes} votes, {percent}%)")
-    content_list.append(f"{expires} <t:{poll["expires"]}:R>")
-    content = ""
-    for line in content_list:
-        content += f"> {line}\n"
-    return content.strip("\n")
+        lines.append(POLL_OPTION_FORMAT.format("*" if option["me_voted"] else "-", option["answer"], answer_votes, percent))
+    lines.append(f"> {expires} <t:{poll["expires"]}:R>")
+    return "\n".join(lines)
 
 
 def build_message(message, roles, channels):
-    """Build message object into text"""
-    content = ""
+    """
+    Build message object into text.
+    roles and channels are dicts: {id: {"id", "name", ...}}
+    """
+    parts = []
 
     if message["interaction"]:
-        content = f"╭──⤙ {message["interaction"]["username"]} used [{message["interaction"]["command"]}]"
+        parts.append(f"╭──⤙ {message["interaction"]["username"]} used [{message["interaction"]["command"]}]")
 
     if "poll" in message:
         message["content"] = format_poll(message["poll"])
 
     if message["content"]:
+        content = message["content"]
+        # all entities start with "<" except discord urls
+        if "<" in content or "https://discord.com/channels/" in content:
+            usernames = {user["id"]: user["username"] for user in message["mentions"]}
+            content = replace_entities(content, usernames, roles, channels)
         if content:
-            content += "\n"
-        content = replace_discord_emoji(message["content"])
-        content = replace_mentions(content, message["mentions"])
-        content = replace_roles(content, roles)
-        content = replace_discord_url(content)
-        content = replace_channels(content, channels)
+            parts.append(content)
 
     for embed in message["embeds"]:
         embed_url = embed["url"]
-        if embed_url and not embed.get("hidden") and embed_url not in content:
-            if content:
-                content += "\n"
+        if embed_url and not embed.get("hidden") and not any(embed_url in part for part in parts):
             if "main_url" not in embed:
-                content += f"[({clean_type(embed["type"])} attachment)]({embed_url})"
+                parts.append(f"[({clean_type(embed["type"])} attachment)]({embed_url})")
             elif embed["type"] == "rich":
-                content += f"(rich embed):\n{embed_url}"
+                parts.append(f"(rich embed):\n{embed_url}")
             else:
-                content += f"[({clean_type(embed["type"])} embed)]({embed_url})"
+                parts.append(f"[({clean_type(embed["type"])} embed)]({embed_url})")
 
     for sticker in message["stickers"]:
-        sticker_type = sticker["format_type"]
-        if content:
-            content += "\n"
-        if sticker_type == 1:
-            content += f"[(png sticker)]({sticker["name"]})"
-        elif sticker_type == 2:
-            content += f"[(apng sticker)]({sticker["name"]})"
-        elif sticker_type == 3:
-            content += f"(lottie sticker: {sticker["name"]})"
-        else:
-            content += f"[(gif sticker)]({sticker["name"]})"
+        parts.append(STICKER_FORMATS.get(sticker["format_type"], STICKER_FORMAT_DEFAULT).format(sticker["name"]))
 
-    return content
+    return "\n".join(parts)
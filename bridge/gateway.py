@@ -1,6 +1,6 @@
 import http.client
-import json
 import logging
+import queue
 import random
 import socket
 import struct
@@ -12,34 +12,29 @@ import urllib
 import urllib.parse
 import zlib
 
+import orjson
 import websocket
 
 from bridge.message import prepare_message
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 DISCORD_HOST = "discord.com"
 ZLIB_SUFFIX = b"\x00\x00\xff\xff"
-inflator = zlib.decompressobj()
+CLOSE_CODE = struct.Struct("!H")
+HEARTBEAT_TEMPLATE = b'{"op":1,"d":%b}'
 logger = logging.getLogger(__name__)
 
 
-def zlib_decompress(data):
-    """Decompress zlib data, if it is not zlib compressed, return data instead"""
-    buffer = bytearray()
-    buffer.extend(data)
-    if len(data) < 4 or data[-4:] != ZLIB_SUFFIX:
-        return data
-    try:
-        return inflator.decompress(buffer)
-    except zlib.error as e:
-        logger.error(f"zlib error: {e}")
-        return None
-
+class NameAdapter(logging.LoggerAdapter):
+    """Logger adapter that prefixes messages with gateway name, only when record is actually logged"""
 
-def reset_inflator():
-    """Resets inflator object"""
-    global inflator
-    del inflator
-    inflator = zlib.decompressobj()   # noqa
+    def process(self, msg, kwargs):
+        """Prepend name to log message"""
+        return f"({self.extra["name"]}) {msg}", kwargs
 
 
 class Gateway():
@@ -60,7 +55,10 @@ class Gateway():
             "User-Agent: endcord",
         ]
         self.name = name
+        self.logger = NameAdapter(logger, {"name": name})
         self.compressed = compressed
+        # zstd-stream is only supported by discord
+        self.zstd = compressed and zstandard is not None and self.host == DISCORD_HOST
         self.init_time = time.time() * 1000
         self.token = token
         self.run = True
@@ -69,29 +67,92 @@ class Gateway():
         self.sequence = None
         self.resume_gateway_url = ""
         self.session_id = ""
-        self.ready = False
+        self.ready = threading.Event()
         self.my_id = None
-        self.messages_buffer = []
-        self.reconnect_requested = False
+        self.messages_buffer = queue.SimpleQueue()
+        self.reconnect_lock = threading.Lock()
+        self.reconnect_thread = threading.Thread()
+        self.heartbeat_stop = threading.Event()
+        self.stopped = threading.Event()
         self.legacy = False
         self.error = None
         self.resumable = False
-        threading.Thread(target=self.thread_guard, daemon=True, args=()).start()
+        # identify payload never changes, so it is serialized only once
+        self.identify_payload = orjson.dumps({
+            "op": 2,
+            "d": {
+                "token": self.token,
+                "properties": {
+                    "os": sys.platform,
+                    "browser": "endcord",
+                    "device": "endcord",
+                },
+                "intents": 1536,
+                "presence": {
+                    "activities": [],
+                    "status": "online",
+                    "since": None,
+                    "afk": False,
+                },
+            },
+        })
+        self.reset_inflator()
+        self.event_handlers = {
+            "READY": self.handle_ready,
+            "MESSAGE_CREATE": self.handle_message_create,
+            "MESSAGE_UPDATE": self.handle_message_update,
+            "MESSAGE_DELETE": self.handle_message_delete,
+            "MESSAGE_REACTION_ADD": self.handle_message_reaction_add,
+            "MESSAGE_REACTION_ADD_MANY": self.handle_message_reaction_add_many,
+            "MESSAGE_REACTION_REMOVE": self.handle_message_reaction_remove,
+        }
 
 
-    def thread_guard(self):
+    def request_reconnect(self):
         """
-        Check if reconnect is requested and run reconnect thread if its not running.
-        This is one in main thread so other threads are not further recursing when
-        reconnecting multiple times.
+        Run reconnect thread if its not already running.
+        Requests made while reconnecting are dropped, so threads are not further
+        recursing when reconnecting multiple times.
         """
-        while self.run:
-            if self.reconnect_requested:
-                self.reconnect_requested = False
-                if not self.reconnect_thread.is_alive():
-                    self.reconnect_thread = threading.Thread(target=self.reconnect, daemon=True, args=())
-                    self.reconnect_thread.start()
-            time.sleep(0.5)
+        with self.reconnect_lock:
+            if self.run and not self.reconnect_thread.is_alive():
+                self.reconnect_thread = threading.Thread(target=self.reconnect, daemon=True, args=())
+                self.reconnect_thread.start()
+
+
+    def decompress(self, data):
+        """Decompress data with zstd or zlib, depending on gateway compression"""
+        if self.zstd:
+            return self.zstd_decompress(data)
+        return self.zlib_decompress(data)
+
+
+    def zstd_decompress(self, data):
+        """Decompress zstd data"""
+        try:
+            return self.inflator.decompress(data)
+        except zstandard.ZstdError as e:
+            self.logger.error(f"zstd error: {e}")
+            return None
+
+
+    def zlib_decompress(self, data):
+        """Decompress zlib data, if it is not zlib compressed, return data instead"""
+        if data[-4:] != ZLIB_SUFFIX:
+            return data
+        try:
+            return self.inflator.decompress(data)
+        except zlib.error as e:
+            self.logger.error(f"zlib error: {e}")
+            return None
+
+
+    def reset_inflator(self):
+        """Reset inflator, new connection starts new compression stream"""
+        if self.zstd:
+            self.inflator = zstandard.ZstdDecompressor().decompressobj()
+        else:
+            self.inflator = zlib.decompressobj()
 
 
     def connect_ws(self, resume=False):
@@ -100,8 +161,10 @@ class Gateway():
             gateway_url = self.resume_gateway_url
         else:
             gateway_url = self.gateway_url
-        self.ws = websocket.WebSocket()
-        if self.compressed:
+        self.ws = websocket.WebSocket(skip_utf8_validation=True)   # json decoder validates utf-8 anyway
+        if self.zstd:
+            self.ws.connect(gateway_url + "/?v=9&encoding=json&compress=zstd-stream", header=self.header)
+        elif self.compressed:
             self.ws.connect(gateway_url + "/?v=9&encoding=json&compress=zlib-stream", header=self.header)
         else:
             self.ws.connect(gateway_url + "/?v=9&encoding=json", header=self.header)
@@ -117,31 +180,30 @@ class Gateway():
             connection.request("GET", "/api/v9/gateway")
         except (socket.gaierror, TimeoutError):
             connection.close()
-            logger.warning(f"({self.name}) No internet connection. Exiting...")
+            self.logger.warning("No internet connection. Exiting...")
             raise SystemExit("No internet connection. Exiting...")
         response = connection.getresponse()
         if response.status == 200:
             data = response.read()
             connection.close()
-            self.gateway_url = json.loads(data)["url"]
+            self.gateway_url = orjson.loads(data)["url"]
         else:
             connection.close()
-            logger.error(f"({self.name}) Failed to get gateway url. Response code: {response.status}. Exiting...")
+            self.logger.error(f"Failed to get gateway url. Response code: {response.status}. Exiting...")
             raise SystemExit(f"Failed to get gateway url. Response code: {response.status}. Exiting...")
 
         self.connect_ws()
         data = self.ws.recv()
         if self.compressed:
-            data = zlib_decompress(data)
+            data = self.decompress(data)
         if data:
-            self.heartbeat_interval = int(json.loads(data)["d"]["heartbeat_interval"])
+            self.heartbeat_interval = int(orjson.loads(data)["d"]["heartbeat_interval"])
         else:
             self.heartbeat_interval = 41250
         self.receiver_thread = threading.Thread(target=self.safe_function_wrapper, daemon=True, args=(self.receiver, ))
         self.receiver_thread.start()
         self.heartbeat_thread = threading.Thread(target=self.send_heartbeat, daemon=True)
         self.heartbeat_thread.start()
-        self.reconnect_thread = threading.Thread()
         self.authenticate()
 
 
@@ -154,24 +216,41 @@ class Gateway():
             function(*args)
         except BaseException as e:
             self.error = f"({self.name})" + "".join(traceback.format_exception(e))
+            self.messages_buffer.put(None)   # wake up consumer waiting in get_messages
 
 
     def send(self, request):
         """Send data to gateway"""
+        self.send_raw(orjson.dumps(request))
+
+
+    def send_raw(self, data):
+        """Send already serialized json to gateway"""
         try:
-            self.ws.send(json.dumps(request))
+            # bytes are sent as text frame
+            self.ws.send(data)
         except websocket._exceptions.WebSocketException:
-            self.reconnect_requested = True
+            self.request_reconnect()
+
+
+    def send_heartbeat_payload(self):
+        """Send heartbeat with current sequence number"""
+        sequence = self.sequence
+        self.send_raw(HEARTBEAT_TEMPLATE % (b"null" if sequence is None else str(sequence).encode()))
 
 
     def receiver(self):
         """Receive and handle all traffic from gateway, should be run in a thread"""
-        logger.info(f"({self.name}) Receiver started")
+        self.logger.info("Receiver started")
         self.resumable = False
         abnormal = False
+        decompress = self.decompress
+        loads = orjson.loads
+        event_handlers = self.event_handlers
+        debug_enabled = self.logger.isEnabledFor(logging.DEBUG)
         while self.run and not self.wait:
             try:
-                ws_opcode, data = self.ws.recv_data()
+                ws_opcode, data = self.ws.recv_data()   # ws is replaced on reconnect
             except (
                 ConnectionResetError,
                 websocket._exceptions.WebSocketConnectionClosedException,
@@ -183,20 +262,21 @@ class Gateway():
                 if not data:
                     self.resumable = True
                     break
-                code = struct.unpack("!H", data[0:2])[0]
+                code = CLOSE_CODE.unpack_from(data, 0)[0]
                 reason = data[2:].decode("utf-8", "replace")
-                logger.warning(f"({self.name}) Gateway error code: {code}, reason: {reason}")
+                self.logger.warning(f"Gateway error code: {code}, reason: {reason}")
                 self.resumable = code in (4000, 4009)
                 if code == 4004:
                     self.run = False
+                    self.stopped.set()
                     print(f"{self.name} token is invalid")
                 break
             try:
                 if self.compressed:
-                    data = zlib_decompress(data)
+                    data = decompress(data)
                 if data:
                     try:
-                        response = json.loads(data)
+                        response = loads(data)
                         opcode = response["op"]
                     except ValueError:
                         response = None
@@ -205,10 +285,11 @@ class Gateway():
                     response = None
                     opcode = None
             except Exception as e:
-                logger.warning(f"({self.name}) Receiver error: {e}")
+                self.logger.warning(f"Receiver error: {e}")
                 self.resumable = True
                 break
-            logger.debug(f"({self.name}) Received: opcode={opcode}, optext={response["t"] if (response and "t" in response and response["t"] and "LIST" not in response["t"]) else 'None'}")
+            if debug_enabled:
+                self.logger.debug(f"Received: opcode={opcode}, optext={response["t"] if (response and "t" in response and response["t"] and "LIST" not in response["t"]) else 'None'}")
             # debug_events
             # if response.get("t"):
             #     debug.save_json(response, f"{response["t"]}.json", False)
@@ -220,183 +301,179 @@ class Gateway():
                 self.heartbeat_interval = int(response["d"]["heartbeat_interval"])
 
             elif opcode == 1:
-                self.send({"op": 1, "d": self.sequence})
+                self.send_heartbeat_payload()
 
             elif opcode == 0:
                 self.sequence = int(response["s"])
                 optext = response["t"]
                 data = response["d"]
-
-                if optext == "READY":
-                    self.resume_gateway_url = data["resume_gateway_url"]
-                    self.session_id = data["session_id"]
-                    self.my_id = data["user"]["id"]
-                    self.ready = True
-
-                elif optext == "MESSAGE_CREATE":
-                    message = response["d"]
-                    message_done = prepare_message(message)
-                    message_done.update({
-                        "channel_id": message["channel_id"],
-                        "guild_id": message.get("guild_id"),
-                    })
-                    self.messages_buffer.append({
-                        "op": "MESSAGE_CREATE",
-                        "d": message_done,
-                    })
-
-                elif optext == "MESSAGE_UPDATE":
-                    message = response["d"]
-                    message_done = prepare_message(message)
-                    message_done.update({
-                        "channel_id": message["channel_id"],
-                        "guild_id": message.get("guild_id"),
-                    })
-                    self.messages_buffer.append({
-                        "op": "MESSAGE_UPDATE",
-                        "d": message_done,
-                    })
-
-                elif optext == "MESSAGE_DELETE":
-                    ready_data = {
-                        "id": data["id"],
-                        "channel_id": data["channel_id"],
-                        "guild_id": data.get("guild_id"),
-                    }
-                    self.messages_buffer.append({
-                        "op": "MESSAGE_DELETE",
-                        "d": ready_data,
-                    })
-
-                elif optext == "MESSAGE_REACTION_ADD":
-                    if "member" in data and "user" in data["member"]:   # spacebar_fix - "user" is mising
-                        user_id = data["member"]["user"]["id"]
-                        username = data["member"]["user"]["username"]
-                        global_name = data["member"]["user"].get("global_name")   # spacebar_fix - get
-                        nick = data["member"]["user"].get("nick")
-                    else:
-                        user_id = data["user_id"]
-                        username = None
-                        global_name = None
-                        nick = None
-                    ready_data = {
-                        "id": data["message_id"],
-                        "channel_id": data["channel_id"],
-                        "guild_id": data.get("guild_id"),
-                        "emoji": data["emoji"]["name"],
-                        "emoji_id": data["emoji"].get("id"),   # spacebar_fix - get
-                        "user_id": user_id,
-                        "username": username,
-                        "global_name": global_name,
-                        "nick": nick,
-                    }
-                    self.messages_buffer.append({
-                        "op": "MESSAGE_REACTION_ADD",
-                        "d": ready_data,
-                    })
-
-                elif optext == "MESSAGE_REACTION_ADD_MANY":
-                    channel_id = data["channel_id"]
-                    guild_id = data.get("guild_id")
-                    message_id = data["message_id"]
-                    for reaction in data["reactions"]:
-                        for user_id in reaction["users"]:
-                            ready_data = {
-                                "id": message_id,
-                                "channel_id": channel_id,
-                                "guild_id": guild_id,
-                                "emoji": reaction["emoji"]["name"],
-                                "emoji_id": reaction["emoji"]["id"],
-                                "user_id": user_id,
-                                "username": None,
-                                "global_name": None,
-                                "nick": None,
-                            }
-                            self.messages_buffer.append({
-                                "op": "MESSAGE_REACTION_ADD",
-                                "d": ready_data,
-                            })
-
-                elif optext == "MESSAGE_REACTION_REMOVE":
-                    ready_data = {
-                        "id": data["message_id"],
-                        "channel_id": data["channel_id"],
-                        "guild_id": data.get("guild_id"),
-                        "emoji": data["emoji"]["name"],
-                        "emoji_id": data["emoji"].get("id"),   # spacebar_fix - get
-                        "user_id": data["user_id"],
-                    }
-                    self.messages_buffer.append({
-                        "op": "MESSAGE_REACTION_REMOVE",
-                        "d": ready_data,
-                    })
-
+                handler = event_handlers.get(optext)
+                if handler:
+                    handler(data)
 
             elif opcode == 7:
-                logger.info(f"({self.name}) Host requested reconnect")
+                self.logger.info("Host requested reconnect")
                 self.resumable = True
                 break
 
             elif opcode == 9:
-                logger.info(f"({self.name}) Session invalidated, reconnecting")
+                self.logger.info("Session invalidated, reconnecting")
                 break
 
             if abnormal:
                 self.resumable = True
                 break
 
-        logger.info(f"({self.name}) Receiver stopped")
-        self.reconnect_requested = True
-        self.heartbeat_running = False
+        self.logger.info("Receiver stopped")
+        self.heartbeat_stop.set()
+        self.request_reconnect()
+
+
+    def handle_ready(self, data):
+        """Handle READY event"""
+        self.resume_gateway_url = data["resume_gateway_url"]
+        self.session_id = data["session_id"]
+        self.my_id = data["user"]["id"]
+        self.ready.set()
+
+
+    def handle_message_create(self, data):
+        """Handle MESSAGE_CREATE event"""
+        message_done = prepare_message(data)
+        message_done["channel_id"] = data["channel_id"]
+        message_done["guild_id"] = data.get("guild_id")
+        self.messages_buffer.put({
+            "op": "MESSAGE_CREATE",
+            "d": message_done,
+        })
+
+
+    def handle_message_update(self, data):
+        """Handle MESSAGE_UPDATE event"""
+        message_done = prepare_message(data)
+        message_done["channel_id"] = data["channel_id"]
+        message_done["guild_id"] = data.get("guild_id")
+        self.messages_buffer.put({
+            "op": "MESSAGE_UPDATE",
+            "d": message_done,
+        })
+
+
+    def handle_message_delete(self, data):
+        """Handle MESSAGE_DELETE event"""
+        ready_data = {
+            "id": data["id"],
+            "channel_id": data["channel_id"],
+            "guild_id": data.get("guild_id"),
+        }
+        self.messages_buffer.put({
+            "op": "MESSAGE_DELETE",
+            "d": ready_data,
+        })
+
+
+    def handle_message_reaction_add(self, data):
+        """Handle MESSAGE_REACTION_ADD event"""
+        member = data.get("member")
+        user = member.get("user") if member else None   # spacebar_fix - "user" is mising
+        if user:
+            user_id = user["id"]
+            username = user["username"]
+            global_name = user.get("global_name")   # spacebar_fix - get
+            nick = user.get("nick")
+        else:
+            user_id = data["user_id"]
+            username = None
+            global_name = None
+            nick = None
+        emoji = data["emoji"]
+        ready_data = {
+            "id": data["message_id"],
+            "channel_id": data["channel_id"],
+            "guild_id": data.get("guild_id"),
+            "emoji": emoji["name"],
+            "emoji_id": emoji.get("id"),   # spacebar_fix - get
+            "user_id": user_id,
+            "username": username,
+            "global_name": global_name,
+            "nick": nick,
+        }
+        self.messages_buffer.put({
+            "op": "MESSAGE_REACTION_ADD",
+            "d": ready_data,
+        })
+
+
+    def handle_message_reaction_add_many(self, data):
+        """Handle MESSAGE_REACTION_ADD_MANY event, expands it into multiple MESSAGE_REACTION_ADD events"""
+        channel_id = data["channel_id"]
+        guild_id = data.get("guild_id")
+        message_id = data["message_id"]
+        put = self.messages_buffer.put
+        for reaction in data["reactions"]:
+            emoji = reaction["emoji"]
+            base_data = {
+                "id": message_id,
+                "channel_id": channel_id,
+                "guild_id": guild_id,
+                "emoji": emoji["name"],
+                "emoji_id": emoji["id"],
+                "user_id": None,
+                "username": None,
+                "global_name": None,
+                "nick": None,
+            }
+            for user_id in reaction["users"]:
+                ready_data = base_data.copy()
+                ready_data["user_id"] = user_id
+                put({
+                    "op": "MESSAGE_REACTION_ADD",
+                    "d": ready_data,
+                })
+
+
+    def handle_message_reaction_remove(self, data):
+        """Handle MESSAGE_REACTION_REMOVE event"""
+        ready_data = {
+            "id": data["message_id"],
+            "channel_id": data["channel_id"],
+            "guild_id": data.get("guild_id"),
+            "emoji": data["emoji"]["name"],
+            "emoji_id": data["emoji"].get("id"),   # spacebar_fix - get
+            "user_id": data["user_id"],
+        }
+        self.messages_buffer.put({
+            "op": "MESSAGE_REACTION_REMOVE",
+            "d": ready_data,
+        })
 
 
     def send_heartbeat(self):
         """Send heartbeat to gateway, if response is not received, triggers reconnect, should be run in a thread"""
-        logger.info(f"({self.name}) Heartbeater started, interval={self.heartbeat_interval/1000}s")
-        self.heartbeat_running = True
+        self.logger.info(f"Heartbeater started, interval={self.heartbeat_interval/1000}s")
+        self.heartbeat_stop.clear()
         self.heartbeat_received = True
-        heartbeat_interval_rand = int(self.heartbeat_interval * (0.8 - 0.6 * random.random()) / 1000)
-        heartbeat_sent_time = int(time.time())
-        while self.run and not self.wait and self.heartbeat_running:
-            if time.time() - heartbeat_sent_time >= heartbeat_interval_rand:
-                self.send({"op": 1, "d": self.sequence})
-                heartbeat_sent_time = int(time.time())
-                logger.debug(f"({self.name}) Sent heartbeat")
-                if not self.heartbeat_received:
-                    logger.warning(f"({self.name}) Heartbeat reply not received")
-                    self.resumable = True
-                    break
-                self.heartbeat_received = False
-                heartbeat_interval_rand = int(self.heartbeat_interval * (0.8 - 0.6 * random.random()) / 1000)
-            # sleep(heartbeat_interval * jitter), but jitter is limited to (0.1 - 0.9)
+        while self.run and not self.wait:
+            # sleep(heartbeat_interval * jitter), but jitter is limited to (0.2 - 0.8)
             # in this time heartbeat ack should be received from discord
-            time.sleep(1)
-        logger.info(f"({self.name}) Heartbeater stopped")
-        self.reconnect_requested = True
+            heartbeat_interval_rand = self.heartbeat_interval * (0.8 - 0.6 * random.random()) / 1000
+            if self.heartbeat_stop.wait(heartbeat_interval_rand):
+                break
+            self.send_heartbeat_payload()
+            self.logger.debug("Sent heartbeat")
+            if not self.heartbeat_received:
+                self.logger.warning("Heartbeat reply not received")
+                self.resumable = True
+                break
+            self.heartbeat_received = False
+        self.logger.info("Heartbeater stopped")
+        self.request_reconnect()
 
 
     def authenticate(self):
         """Authenticate client with discord gateway"""
-        payload = {
-            "op": 2,
-            "d": {
-                "token": self.token,
-                "properties": {
-                    "os": sys.platform,
-                    "browser": "endcord",
-                    "device": "endcord",
-                },
-                "intents": 1536,
-                "presence": {
-                    "activities": [],
-                    "status": "online",
-                    "since": None,
-                    "afk": False,
-                },
-            },
-        }
-        self.send(payload)
-        logger.debug(f"({self.name}) Sent identify")
+        self.send_raw(self.identify_payload)
+        self.logger.debug("Sent identify")
 
 
     def resume(self):
@@ -405,36 +482,36 @@ class Gateway():
         Return gateway response code, 9 means resumming has failed
         """
         self.ws.close(timeout=0)   # this will stop receiver
-        time.sleep(1)   # so receiver ends before opening new socket
-        reset_inflator()   # otherwise decompression wont work
+        self.receiver_thread.join(timeout=1)   # so receiver ends before opening new socket
+        self.reset_inflator()   # otherwise decompression wont work
         self.ws = websocket.WebSocket()
         try:
             self.connect_ws(resume=True)
         except websocket._exceptions.WebSocketBadStatusException:
-            logger.info(f"({self.name}) Failed to resume connection")
+            self.logger.info("Failed to resume connection")
             return 9
         if self.compressed:
-            _ = zlib_decompress(self.ws.recv())
+            _ = self.decompress(self.ws.recv())
         else:
             _ = self.ws.recv()
         payload = {"op": 6, "d": {"token": self.token, "session_id": self.session_id, "seq": self.sequence}}
         self.send(payload)
         try:
             if self.compressed:
-                op = json.loads(zlib_decompress(self.ws.recv()))["op"]
+                op = orjson.loads(self.decompress(self.ws.recv()))["op"]
             else:
-                op = json.loads(self.ws.recv())["op"]
-            logger.info(f"({self.name}) Connection resumed")
+                op = orjson.loads(self.ws.recv())["op"]
+            self.logger.info("Connection resumed")
             return op
-        except (json.decoder.JSONDecodeError, websocket._exceptions.WebSocketConnectionClosedException):
-            logger.info(f"({self.name}) Failed to resume connection")
+        except (ValueError, websocket._exceptions.WebSocketConnectionClosedException):
+            self.logger.info("Failed to resume connection")
             return 9
 
 
     def reconnect(self):
         """Try to resume session, if cant, create new one"""
         if not self.wait:
-            logger.info(f"({self.name}) Trying to reconnect")
+            self.logger.info("Trying to reconnect")
         try:
             code = None
             if self.resumable:
@@ -442,13 +519,13 @@ class Gateway():
                 code = self.resume()
             if code == 9:
                 self.ws.close(timeout=0)   # this will stop receiver
-                time.sleep(1)   # so receiver ends before opening new socket
-                reset_inflator()   # otherwise decompression wont work
-                self.ready = False   # will receive new ready event
+                self.receiver_thread.join(timeout=1)   # so receiver ends before opening new socket
+                self.reset_inflator()   # otherwise decompression wont work
+                self.ready.clear()   # will receive new ready event
                 self.ws = websocket.WebSocket()
                 self.connect_ws()
                 self.authenticate()
-                logger.info(f"({self.name}) Restarting connection")
+                self.logger.info("Restarting connection")
             self.wait = False
             # restarting threads
             if not self.receiver_thread.is_alive():
@@ -457,10 +534,10 @@ class Gateway():
             if not self.heartbeat_thread.is_alive():
                 self.heartbeat_thread = threading.Thread(target=self.send_heartbeat, daemon=True)
                 self.heartbeat_thread.start()
-            logger.info(f"({self.name}) Connection established")
+            self.logger.info("Connection established")
         except websocket._exceptions.WebSocketAddressException:
             if not self.wait:   # if not running from wait_oline
-                logger.warning(f"({self.name}) No internet connection")
+                self.logger.warning("No internet connection")
                 self.ws.close()
                 threading.Thread(target=self.wait_online, daemon=True, args=()).start()
 
@@ -468,9 +545,11 @@ class Gateway():
     def wait_online(self):
         """Wait for network, try to reconnect every 5s"""
         self.wait = True
+        self.heartbeat_stop.set()
         while self.run and self.wait:
-            self.reconnect_requested = True
-            time.sleep(5)
+            self.request_reconnect()
+            if self.stopped.wait(5):
+                break
 
 
     def update_presence(self, status, custom_status=None, custom_status_emoji=None):
@@ -494,12 +573,17 @@ class Gateway():
             },
         }
         self.send(payload)
-        logger.debug(f"({self.name}) Updated presence")
+        self.logger.debug("Updated presence")
 
 
     def get_ready(self):
         """Return wether gateway processed entire READY event"""
-        return self.ready
+        return self.ready.is_set()
+
+
+    def wait_ready(self, timeout=None):
+        """Wait until gateway processed entire READY event, return False on timeout"""
+        return self.ready.wait(timeout)
 
 
     def get_my_id(self):
@@ -507,11 +591,34 @@ class Gateway():
         return self.my_id
 
 
-    def get_messages(self):
+    def get_messages(self, timeout=None):
         """
         Get message CREATE, EDIT, DELETE and ACK events for every guild and channel.
         Returns 1 by 1 event as an update for list of messages.
+        If timeout is set, waits up to timeout seconds for next event, otherwise returns immediately.
+        Returns None if there is no event or gateway thread has failed.
         """
-        if len(self.messages_buffer) == 0:
+        try:
+            return self.messages_buffer.get(timeout is not None, timeout)
+        except queue.Empty:
             return None
-        return self.messages_buffer.pop(0)
+
+
+    def get_messages_batch(self, max_n=64, timeout=None):
+        """
+        Get up to max_n buffered events at once, in the same format as get_messages.
+        If timeout is set, waits up to timeout seconds for first event.
+        """
+        batch = []
+        message = self.get_messages(timeout)
+        if message:
+            batch.append(message)
+        get = self.messages_buffer.get_nowait
+        while len(batch) < max_n:
+            try:
+                message = get()
+            except queue.Empty:
+                break
+            if message:
+                batch.append(message)
+        return batch
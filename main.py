@@ -1,23 +1,44 @@
-import json
+import atexit
 import logging
+import logging.handlers
 import os
+import queue
 import signal
 import sys
 import threading
 import time
+import traceback
 
 from bridge import discord, formatter, gateway
+from bridge.config import load_config
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that leaves record formatting to the listener thread"""
+
+    def prepare(self, record):
+        """Enqueue record as is"""
+        return record
+
+
+# bridge threads only enqueue records, formatting and writing is done in listener thread
+log_queue = queue.SimpleQueue()
+log_file_handler = logging.FileHandler("spacebar_bridge.log", mode="w", encoding="utf-8")
+log_file_handler.setFormatter(logging.Formatter(
+    fmt="{asctime} - {levelname}\n  [{module}]: {message}\n",
+    datefmt="%Y-%m-%d-%H:%M:%S",
+    style="{",
+))
+log_listener = logging.handlers.QueueListener(log_queue, log_file_handler)
+log_listener.start()
+atexit.register(log_listener.stop)   # flush queued records on exit
 
 logger = logging
 logging.basicConfig(
     level=os.getenv("LOG_LEVEL", "INFO").upper(),
-    filename="spacebar_bridge.log",
-    encoding="utf-8",
-    filemode="w",
-    format="{asctime} - {levelname}\n  [{module}]: {message}\n",
-    style="{",
-    datefmt="%Y-%m-%d-%H:%M:%S",
+    handlers=[DeferredQueueHandler(log_queue)],
 )
+UPDATE_DELAY = 0.2   # seconds to wait for more updates of the same message
 ERROR_TEXT = "\nUnhandled exception occurred. Please report here: https://github.com/sparklost/spacebar-bridge/issues"
 
 
@@ -40,52 +61,79 @@ def get_author_pfp(message, cdn_url, size=80):
     return None
 
 
+class Server:
+    """Gateway, REST client, database and bridged channels of one side of the bridge"""
+
+    def __init__(self, gateway, discord, database, cdn, my_id, guild_id, channels, bridges, pairs):
+        self.gateway = gateway
+        self.discord = discord
+        self.database = database
+        self.cdn = cdn
+        self.my_id = my_id
+        self.guild_id = guild_id
+        self.channels = channels
+        self.bridges = bridges
+        self.pairs = pairs
+
+
 class Bridge:
     """Bridge class"""
 
     def __init__(self):
-        with open("config.json", "r") as f:
-            config = json.load(f)
+        config = load_config()
         self.run = True
-
-        if config["database"]["postgresql_host"]:
-            self.init_postgresql(config)
+        self.stopped = threading.Event()   # set when any bridge loop stops
+        self.exit_message = None
+        self.error = None
+        self.pending_updates = {}   # (loop name, source message id): latest MESSAGE_UPDATE data
+        self.pending_updates_lock = threading.Lock()
+        self.scheduled_updates = queue.SimpleQueue()   # (due time, update args), in due order since delay is constant
+        # MESSAGE_REACTION_ADD: target reacts to itself if not already
+        # MESSAGE_REACTION_REMOVE: if this is last non-self reaction, target removes self reaction
+        self.event_handlers = {
+            "MESSAGE_CREATE": self.forward_create,
+            "MESSAGE_UPDATE": self.schedule_update,
+            "MESSAGE_DELETE": self.forward_delete,
+        }
+
+        if config.database.postgresql_host:
+            self.init_postgresql(config.database)
         else:
-            self.init_sqlite(config)
+            self.init_sqlite(config.database)
 
-        host_a = config["discord"]["host"]
-        self.cdn_a = config["discord"]["cdn_host"]
-        token_a = config["discord"]["token"]
-        host_b = config["spacebar"]["host"]
-        self.cdn_b = config["spacebar"]["cdn_host"]
-        token_b = config["spacebar"]["token"]
-        bridges = config["bridges"]
-        self.channels = []   # should be loaded from gateway when guild_create event is parsed
-        self.roles = []   # this too
+        host_a = config.discord.host
+        self.cdn_a = config.discord.cdn_host
+        token_a = config.discord.token
+        host_b = config.spacebar.host
+        self.cdn_b = config.spacebar.cdn_host
+        token_b = config.spacebar.token
+        bridges = config.bridges
+        self.channels = {}   # {id: channel}, should be loaded from gateway when guild_create event is parsed
+        self.roles = {}   # {id: role}, this too
 
-        custom_status = config["custom_status"]
-        custom_status_emoji = config["custom_status_emoji"]
+        custom_status = config.custom_status
+        custom_status_emoji = config.custom_status_emoji
 
-        self.guild_id_a = config["discord_guild_id"]
-        self.guild_id_b = config["spacebar_guild_id"]
+        self.guild_id_a = config.discord_guild_id
+        self.guild_id_b = config.spacebar_guild_id
 
-        self.channels_a = []
+        self.channels_a = set()
         self.bridges_a = {}
-        self.bridges_a_txt = []
-        self.channels_b = []
+        self.pairs_a = {}   # source channel: channel pair table name
+        self.channels_b = set()
         self.bridges_b = {}
-        self.bridges_b_txt = []
+        self.pairs_b = {}
         for bridge in bridges:
-            a = bridge["discord_channel_id"]
-            b = bridge["spacebar_channel_id"]
-            self.channels_a.append(a)
+            a = bridge.discord_channel_id
+            b = bridge.spacebar_channel_id
+            self.channels_a.add(a)
             self.bridges_a[a] = b
-            self.bridges_a_txt.append(f"pair_{a}_{b}")
-            self.database_a.create_table(f"pair_{a}_{b}")
-            self.channels_b.append(b)
+            self.pairs_a[a] = f"pair_{a}_{b}"
+            self.database_a.create_table(self.pairs_a[a])
+            self.channels_b.add(b)
             self.bridges_b[b] = a
-            self.bridges_b_txt.append(f"pair_{b}_{a}")
-            self.database_b.create_table(f"pair_{b}_{a}")
+            self.pairs_b[b] = f"pair_{b}_{a}"
+            self.database_b.create_table(self.pairs_b[b])
 
         print("Connecting to gateways")
         self.discord_a = discord.Discord(token_a, host_a, self.cdn_a, "Discord")
@@ -95,7 +143,8 @@ class Bridge:
         self.gateway_b = gateway.Gateway(token_b, host_b, "Spacebar", compressed=False)
         self.gateway_b.connect()
 
-        while not (self.gateway_a.get_ready() and self.gateway_b.get_ready()):
+        # returns as soon as both are ready, timeout is only for checking errors
+        while not (self.gateway_a.wait_ready(0.5) and self.gateway_b.wait_ready(0.5)):
             if self.gateway_a.error:
                 logger.fatal(f"Gateway A error: \n {self.gateway_a.error}")
                 sys.exit(self.gateway_a.error + ERROR_TEXT)
@@ -104,7 +153,6 @@ class Bridge:
                 sys.exit(self.gateway_b.error + ERROR_TEXT)
             if not self.gateway_a.run or not self.gateway_b.run:
                 sys.exit()
-            time.sleep(0.2)
 
         self.my_id_a = self.gateway_a.get_my_id()
         self.my_id_b = self.gateway_b.get_my_id()
@@ -123,321 +171,234 @@ class Bridge:
         logger.info("Bridge initialized successfully")
         print("Bridge initialized successfully")
 
-        threading.Thread(target=self.loop_b, daemon=True).start()
-        self.loop_a()
+        server_a = Server(self.gateway_a, self.discord_a, self.database_a, self.cdn_a, self.my_id_a, self.guild_id_a, self.channels_a, self.bridges_a, self.pairs_a)
+        server_b = Server(self.gateway_b, self.discord_b, self.database_b, self.cdn_b, self.my_id_b, self.guild_id_b, self.channels_b, self.bridges_b, self.pairs_b)
+        loops = (
+            threading.Thread(target=self.bridge_loop, daemon=True, args=("A", server_a, server_b)),   # DISCORD -> SPACEBAR
+            threading.Thread(target=self.bridge_loop, daemon=True, args=("B", server_b, server_a)),   # SPACEBAR -> DISCORD
+            threading.Thread(target=self.update_loop, daemon=True),
+        )
+        for loop in loops:
+            loop.start()
+        self.stopped.wait()
+        self.run = False
+        for loop in loops:
+            loop.join()   # so no new work is submitted while closing
+        self.discord_a.close()
+        self.discord_b.close()
+        if self.exit_message:
+            sys.exit(self.exit_message)
 
 
     def init_sqlite(self, config):
         """Initialize SQLite database"""
         print("Initializing database")
         from bridge import database
-        database_path = os.path.expanduser(config["database"]["dir_path"])
-        cleanup_days = config["database"]["cleanup_days"]
-        pair_lifetime_days = config["database"]["pair_lifetime_days"]
-        if not os.path.exists(database_path):
-            os.makedirs(database_path, exist_ok=True)
-        databse_path_a = os.path.join(database_path, "discord.db")
-        databse_path_b = os.path.join(database_path, "spacebar.db")
-        self.database_a = database.PairStore(databse_path_a, cleanup_days, pair_lifetime_days, name="Discord")
-        self.database_b = database.PairStore(databse_path_b, cleanup_days, pair_lifetime_days, name="Spacebar")
+        os.makedirs(config.dir_path, exist_ok=True)
+        database_path_a = os.path.join(config.dir_path, "discord.db")
+        database_path_b = os.path.join(config.dir_path, "spacebar.db")
+        self.database_a = database.PairStore(database_path_a, config.cleanup_days, config.pair_lifetime_days, name="Discord")
+        self.database_b = database.PairStore(database_path_b, config.cleanup_days, config.pair_lifetime_days, name="Spacebar")
 
 
     def init_postgresql(self, config):
         """"Connect to PostgreSQL database"""
         print("Connecting to postgres databse")
         from bridge import database_postgres
-        host = config["database"]["postgresql_host"]
-        user = config["database"]["postgresql_user"]
-        password = config["database"]["postgresql_password"]
-        cleanup_days = config["database"]["cleanup_days"]
-        pair_lifetime_days = config["database"]["pair_lifetime_days"]
-        self.database_a = database_postgres.PairStore(host, user, password, "bridge_discord_msgs", cleanup_days, pair_lifetime_days, name="Discord")
-        self.database_b = database_postgres.PairStore(host, user, password, "bridge_spacebar_msgs", cleanup_days, pair_lifetime_days, name="Spacebar")
-
-
-    def loop_a(self):   # DISCORD -> SPACEBAR
-        """Loop A"""
+        host = config.postgresql_host
+        user = config.postgresql_user
+        password = config.postgresql_password
+        self.database_a = database_postgres.PairStore(host, user, password, "bridge_discord_msgs", config.cleanup_days, config.pair_lifetime_days, name="Discord")
+        self.database_b = database_postgres.PairStore(host, user, password, "bridge_spacebar_msgs", config.cleanup_days, config.pair_lifetime_days, name="Spacebar")
+
+
+    def build_embeds(self, message, cdn):
+        """Build embeds for bridged message, return embeds, author name and message text"""
+        author_name = get_author_name(message)
+        author_pfp = get_author_pfp(message, cdn)
+        message_text = formatter.build_message(
+            message,
+            self.roles,
+            self.channels,
+        )
+        if not message_text:
+            message_text = "*Unknown message content*"
+        embeds = [{
+            "type": "rich",
+            "author": {
+                "name": author_name,
+            },
+            "description": message_text,
+        }]
+        if author_pfp:
+            embeds[0]["author"]["icon_url"] = author_pfp
+        return embeds, author_name, message_text
+
+
+    def bridge_loop(self, name, source, target):
+        """Forward messages from source server to target server"""
         while self.run:
-
-            # get messages
-            while self.run:
-                new_message = self.gateway_a.get_messages()
-                if new_message:
-                    data = new_message["d"]
-                    if data["channel_id"] in self.channels_a and data.get("user_id") != self.my_id_a:
-                        op = new_message["op"]
-
-                        if op == "MESSAGE_CREATE":
-                            # build message
-                            source_channel = data["channel_id"]
-                            target_channel = self.bridges_a[source_channel]
-                            source_message = data["id"]
-                            author_name = get_author_name(data)
-                            author_pfp = get_author_pfp(data, self.cdn_a)
-                            if data["referenced_message"]:
-                                source_reference_id = data["referenced_message"]["id"]
-                                if data["referenced_message"]["user_id"] == self.my_id_a:
-                                    channel_pair = f"pair_{target_channel}_{source_channel}"
-                                    target_reference_id = self.database_b.get_source(channel_pair, source_reference_id)
-                                else:
-                                    channel_pair = f"pair_{source_channel}_{target_channel}"
-                                    target_reference_id = target_message = self.database_a.get_target(channel_pair, source_reference_id)
-                                for mention in data["referenced_message"]["mentions"]:
-                                    if mention["id"] == self.my_id_a:
-                                        reply_ping = True
-                                        break
-                                else:
-                                    reply_ping = False
-                            else:
-                                target_reference_id = None
-                                reply_ping = True
-                            message_text = formatter.build_message(
-                                data,
-                                self.roles,
-                                self.channels,
-                            )
-                            if not message_text:
-                                message_text = "*Unknown message content*"
-                            embeds = [{
-                                "type": "rich",
-                                "author": {
-                                    "name": author_name,
-                                },
-                                "description": message_text,
-                            }]
-                            if author_pfp:
-                                embeds[0]["author"]["icon_url"] = author_pfp
-                            # send message
-                            target_message = self.discord_b.send_message(
-                                channel_id=target_channel,
-                                message_content="",
-                                reply_id=target_reference_id,
-                                reply_channel_id=target_channel,
-                                reply_guild_id=self.guild_id_b,
-                                reply_ping=reply_ping,
-                                embeds=embeds,
-                            )
-                            # add to db
-                            if target_message:
-                                logger.debug(f"CREATE (A): = {source_channel} > {target_channel} = [{author_name}] - ({source_message}) - {message_text}")
-                                channel_pair = f"pair_{source_channel}_{target_channel}"
-                                if channel_pair in self.bridges_a_txt:
-                                    self.database_a.add_pair(channel_pair, source_message, target_message)
-                                else:
-                                    logger.warning(f"Channel pair (A): {channel_pair} not initialized")
-
-                        elif op == "MESSAGE_UPDATE":
-                            source_channel = data["channel_id"]
-                            target_channel = self.bridges_a[source_channel]
-                            channel_pair = f"pair_{source_channel}_{target_channel}"
-                            if channel_pair in self.bridges_a_txt:
-                                source_message = data["id"]
-                                target_message = self.database_a.get_target(channel_pair, source_message)
-                                if target_message:
-                                    author_name = get_author_name(data)
-                                    author_pfp = get_author_pfp(data, self.cdn_a)
-                                    message_text = formatter.build_message(
-                                        data,
-                                        self.roles,
-                                        self.channels,
-                                    )
-                                    if not message_text:
-                                        message_text = "*Unknown message content*"
-                                    embeds = [{
-                                        "type": "rich",
-                                        "author": {
-                                            "name": author_name,
-                                        },
-                                        "description": message_text,
-                                    }]
-                                    if author_pfp:
-                                        embeds[0]["author"]["icon_url"] = author_pfp
-                                    self.discord_b.send_update_message(
-                                        channel_id=target_channel,
-                                        message_id=target_message,
-                                        message_content="",
-                                        embeds=embeds,
-                                    )
-                                    logger.debug(f"EDIT (A): = {source_channel} > {target_channel} = [{author_name}] - ({source_message}) - {message_text}")
-                            else:
-                                logger.warning(f"Channel pair (A): {channel_pair} not initialized")
-
-                        elif op == "MESSAGE_DELETE":
-                            source_channel = data["channel_id"]
-                            target_channel = self.bridges_a[source_channel]
-                            channel_pair = f"pair_{source_channel}_{target_channel}"
-                            if channel_pair in self.bridges_a_txt:
-                                source_message = data["id"]
-                                target_message = self.database_a.get_target(channel_pair, source_message)
-                                if target_message:
-                                    self.discord_b.send_delete_message(target_channel, target_message)
-                                    logger.debug(f"DELETE (A): = {source_channel} > {target_channel} = ({source_message})")
-                                    self.database_a.delete_pair(channel_pair, source_message)
-                            else:
-                                logger.warning(f"Channel pair (A): {channel_pair} not initialized")
-
-                        elif op == "MESSAGE_REACTION_ADD":
-                            # A receives reaction_add
-                            # B reacts to itself if not already
-                            pass
-
-                        elif op == "MESSAGE_REACTION_REMOVE":
-                            # A receives reaction_delete
-                            # check if this is last non-self reaction
-                            #     B removes self reaction
-                            pass
-
-                else:
-                    break
-
-            # check gateway for errors
-            if self.gateway_a.error:
-                logger.fatal(f"Gateway error: \n {self.gateway_a.error}")
-                sys.exit(self.gateway_a.error + ERROR_TEXT)
-
-            time.sleep(0.1)   # some reasonable delay
+            batch = source.gateway.get_messages_batch(timeout=1)
+            channel_events = {}
+            for new_message in batch:
+                data = new_message["d"]
+                if data["channel_id"] in source.channels and data.get("user_id") != source.my_id:
+                    target_channel = source.bridges[data["channel_id"]]
+                    channel_events.setdefault(target_channel, []).append(new_message)
+
+            # each target channel has its own worker, so channels are sent in parallel but in order
+            for target_channel, events in channel_events.items():
+                future = target.discord.submit(target_channel, self.forward_events, name, source, target, events)
+                if future:
+                    future.add_done_callback(self.check_forward_error)
+
+            # check for errors
+            if source.gateway.error:
+                logger.fatal(f"Gateway error: \n {source.gateway.error}")
+                self.exit_message = source.gateway.error + ERROR_TEXT
+                break
+            if self.error:
+                logger.fatal(f"Bridge error: \n {self.error}")
+                self.exit_message = self.error + ERROR_TEXT
+                break
         self.run = False
+        self.stopped.set()
 
 
-    def loop_b(self):   # SPACEBAR -> DISCORD
-        """Loop B"""
-        while self.run:
+    def check_forward_error(self, future):
+        """Store error raised while forwarding events, so it can be handled in bridge loop"""
+        error = future.exception()
+        if error:
+            self.error = "".join(traceback.format_exception(error))
 
-            # get messages
-            while self.run:
-                new_message = self.gateway_b.get_messages()
-                if new_message:
-                    data = new_message["d"]
-                    if data["channel_id"] in self.channels_b and data.get("user_id") != self.my_id_b:
-                        op = new_message["op"]
-
-                        if op == "MESSAGE_CREATE":
-                            # build message
-                            source_channel = data["channel_id"]
-                            target_channel = self.bridges_b[source_channel]
-                            source_message = data["id"]
-                            author_name = get_author_name(data)
-                            author_pfp = get_author_pfp(data, self.cdn_b)
-                            if data["referenced_message"]:
-                                source_reference_id = data["referenced_message"]["id"]
-                                if data["referenced_message"]["user_id"] == self.my_id_b:
-                                    channel_pair = f"pair_{target_channel}_{source_channel}"
-                                    target_reference_id = self.database_a.get_source(channel_pair, source_reference_id)
-                                else:
-                                    channel_pair = f"pair_{source_channel}_{target_channel}"
-                                    target_reference_id = target_message = self.database_b.get_target(channel_pair, source_reference_id)
-                                for mention in data["referenced_message"]["mentions"]:
-                                    if mention["id"] == self.my_id_b:
-                                        reply_ping = True
-                                        break
-                                else:
-                                    reply_ping = False
-                            else:
-                                target_reference_id = None
-                                reply_ping = True
-                            # build message
-                            message_text = formatter.build_message(
-                                data,
-                                self.roles,
-                                self.channels,
-                            )
-                            if not message_text:
-                                message_text = "*Unknown message content*"
-                            embeds = [{
-                                "type": "rich",
-                                "author": {
-                                    "name": author_name,
-                                },
-                                "description": message_text,
-                            }]
-                            if author_pfp:
-                                embeds[0]["author"]["icon_url"] = author_pfp
-                            # send message
-                            target_message = self.discord_a.send_message(
-                                channel_id=target_channel,
-                                message_content="",
-                                reply_id=target_reference_id,
-                                reply_channel_id=target_channel,
-                                reply_guild_id=self.guild_id_a,
-                                reply_ping=reply_ping,
-                                embeds=embeds,
-                            )
-                            # add to db
-                            if target_message:
-                                logger.debug(f"CREATE (B): {source_channel}-{source_message} > {target_channel}={target_message} = [{author_name}] - {message_text}")
-                                channel_pair = f"pair_{source_channel}_{target_channel}"
-                                if channel_pair in self.bridges_b_txt:
-                                    self.database_b.add_pair(channel_pair, source_message, target_message)
-                                else:
-                                    logger.warning(f"Channel pair (B): {channel_pair} not initialized")
-
-                        elif op == "MESSAGE_UPDATE":
-                            source_channel = data["channel_id"]
-                            target_channel = self.bridges_b[source_channel]
-                            channel_pair = f"pair_{source_channel}_{target_channel}"
-                            if channel_pair in self.bridges_b_txt:
-                                source_message = data["id"]
-                                target_message = self.database_b.get_target(channel_pair, source_message)
-                                if target_message:
-                                    author_name = get_author_name(data)
-                                    author_pfp = get_author_pfp(data, self.cdn_b)
-                                    message_text = formatter.build_message(
-                                        data,
-                                        self.roles,
-                                        self.channels,
-                                    )
-                                    if not message_text:
-                                        message_text = "*Unknown message content*"
-                                    embeds = [{
-                                        "type": "rich",
-                                        "author": {
-                                            "name": author_name,
-                                        },
-                                        "description": message_text,
-                                    }]
-                                    if author_pfp:
-                                        embeds[0]["author"]["icon_url"] = author_pfp
-                                    self.discord_a.send_update_message(
-                                        channel_id=target_channel,
-                                        message_id=target_message,
-                                        message_content="",
-                                        embeds=embeds,
-                                    )
-                                    logger.debug(f"EDIT (B): = {source_channel}-{source_message} > {target_channel}={target_message} = [{author_name}] - {message_text}")
-                            else:
-                                logger.warning(f"Channel pair (B): {channel_pair} not initialized")
-
-                        elif op == "MESSAGE_DELETE":
-                            source_channel = data["channel_id"]
-                            target_channel = self.bridges_b[source_channel]
-                            channel_pair = f"pair_{source_channel}_{target_channel}"
-                            if channel_pair in self.bridges_b_txt:
-                                source_message = data["id"]
-                                target_message = self.database_b.get_target(channel_pair, source_message)
-                                if target_message:
-                                    self.discord_a.send_delete_message(target_channel, target_message)
-                                    logger.debug(f"DELETE (B): = {source_channel} > {target_channel} = ({source_message})")
-                                    self.database_b.delete_pair(channel_pair, source_message)
-                            else:
-                                logger.warning(f"Channel pair (B): {channel_pair} not initialized")
-
-                        elif op == "MESSAGE_REACTION_ADD":
-                            pass
-
-                        elif op == "MESSAGE_REACTION_REMOVE":
-                            pass
-
-                else:
-                    break
-
-            # check gateway for errors
-            if self.gateway_a.error:
-                logger.fatal(f"Gateway error: \n {self.gateway_b.error}")
-                sys.exit(self.gateway_b.error + ERROR_TEXT)
-
-            time.sleep(0.1)   # some reasonable delay
-        self.run = False
 
+    def update_loop(self):
+        """Submit scheduled message updates when their UPDATE_DELAY has passed"""
+        while self.run:
+            try:
+                due, args = self.scheduled_updates.get(timeout=1)
+            except queue.Empty:
+                continue
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self.submit_update(*args)
+
+
+    def submit_update(self, name, source, target, target_channel, key):
+        """Queue pending message update in target channel worker"""
+        future = target.discord.submit(target_channel, self.forward_update, name, source, target, key)
+        if future:   # None if already closed
+            future.add_done_callback(self.check_forward_error)
+
+
+    def forward_update(self, name, source, target, key):
+        """Forward latest pending update of a message, should be run in target channel worker"""
+        with self.pending_updates_lock:
+            data = self.pending_updates.pop(key, None)
+        if not data:   # message is deleted
+            return
+        source_channel = data["channel_id"]
+        target_channel = source.bridges[source_channel]
+        channel_pair = source.pairs[source_channel]
+        source_message = data["id"]
+        target_message = source.database.get_target(channel_pair, source_message)
+        if target_message:
+            embeds, author_name, message_text = self.build_embeds(data, source.cdn)
+            target.discord.send_update_message(
+                channel_id=target_channel,
+                message_id=target_message,
+                message_content="",
+                embeds=embeds,
+            )
+            logger.debug("EDIT (%s): %s-%s > %s-%s = [%s] - %s", name, source_channel, source_message, target_channel, target_message, author_name, message_text)
+
+
+    def get_delete_targets(self, source, events):
+        """Get target ids of all deleted messages in events, with one query per channel pair"""
+        deleted = {}
+        for new_message in events:
+            if new_message["op"] == "MESSAGE_DELETE":
+                data = new_message["d"]
+                deleted.setdefault(source.pairs[data["channel_id"]], []).append(data["id"])
+        targets = {}
+        for channel_pair, source_messages in deleted.items():
+            targets.update(source.database.get_targets(channel_pair, source_messages))
+        return targets
+
+
+    def forward_events(self, name, source, target, events):
+        """Forward events from one source channel to its target channel, should be run in target channel worker"""
+        targets = self.get_delete_targets(source, events)
+        event_handlers = self.event_handlers
+        for new_message in events:
+            handler = event_handlers.get(new_message["op"])
+            if handler:
+                handler(name, source, target, new_message["d"], targets)
+
+
+    def forward_create(self, name, source, target, data, targets):
+        """Forward MESSAGE_CREATE event"""
+        # build message
+        source_channel = data["channel_id"]
+        target_channel = source.bridges[source_channel]
+        source_message = data["id"]
+        if data["referenced_message"]:
+            source_reference_id = data["referenced_message"]["id"]
+            if data["referenced_message"]["user_id"] == source.my_id:
+                channel_pair = target.pairs[target_channel]
+                target_reference_id = target.database.get_source(channel_pair, source_reference_id)
+            else:
+                channel_pair = source.pairs[source_channel]
+                target_reference_id = source.database.get_target(channel_pair, source_reference_id)
+            reply_ping = any(mention["id"] == source.my_id for mention in data["referenced_message"]["mentions"])
+        else:
+            target_reference_id = None
+            reply_ping = True
+        embeds, author_name, message_text = self.build_embeds(data, source.cdn)
+        # send message
+        target_message = target.discord.send_message(
+            channel_id=target_channel,
+            message_content="",
+            reply_id=target_reference_id,
+            reply_channel_id=target_channel,
+            reply_guild_id=target.guild_id,
+            reply_ping=reply_ping,
+            embeds=embeds,
+        )
+        # add to db
+        if target_message:
+            logger.debug("CREATE (%s): %s-%s > %s-%s = [%s] - %s", name, source_channel, source_message, target_channel, target_message, author_name, message_text)
+            # add right away, so replies from other side can be looked up
+            source.database.add_pair(source.pairs[source_channel], source_message, target_message)
+            targets[source_message] = target_message
+
+
+    def schedule_update(self, name, source, target, data, _targets):
+        """Schedule forwarding of MESSAGE_UPDATE event"""
+        # edits often come in bursts (eg. embed unfurling), so only latest one is bridged after UPDATE_DELAY
+        key = (name, data["id"])
+        with self.pending_updates_lock:
+            scheduled = key in self.pending_updates
+            self.pending_updates[key] = data
+        if not scheduled:
+            target_channel = source.bridges[data["channel_id"]]
+            self.scheduled_updates.put((time.monotonic() + UPDATE_DELAY, (name, source, target, target_channel, key)))
+
+
+    def forward_delete(self, name, source, target, data, targets):
+        """Forward MESSAGE_DELETE event"""
+        with self.pending_updates_lock:
+            self.pending_updates.pop((name, data["id"]), None)   # dont send update of deleted message
+        source_channel = data["channel_id"]
+        target_channel = source.bridges[source_channel]
+        channel_pair = source.pairs[source_channel]
+        source_message = data["id"]
+        target_message = targets.pop(source_message, None)
+        if target_message:
+            target.discord.send_delete_message(target_channel, target_message)
+            logger.debug("DELETE (%s): %s-%s > %s-%s", name, source_channel, source_message, target_channel, target_message)
+            source.database.delete_pair(channel_pair, source_message)
 
 
 def sigint_handler(_signum, _frame):